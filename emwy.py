@@ -3,17 +3,27 @@
 import re
 import os
 import sys
+import shlex
 import time
 import yaml
 import json
 import shutil
+import hashlib
+import tempfile
 import pprint
 import argparse
 import subprocess
+import concurrent.futures
 from emwylib import soxlib
 from emwylib import medialib
 from emwylib import ffmpeglib
-from emwylib import titlecard
+
+#use the LibYAML C bindings when available, they are much faster
+try:
+	from yaml import CSafeLoader as SafeLoader
+except ImportError:
+	from yaml import SafeLoader
+	print("warning: PyYAML was built without LibYAML, yaml parsing will be slow")
 
 ### TODO
 # add background music
@@ -30,44 +40,91 @@ from emwylib import titlecard
 
 debug = True
 skipcodes = {'noise': True, 'stop': True, 'skip': True, }
+uppercase = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+#type of each audio and video setting allowed in the yaml file
+setting_types = { 'quality': str, 'samplerate': int, 'bitrate': int,
+	'crf': int, 'movframerate': int, 'extra_audio_process': bool,
+	'lame_preset': str, 'norm_level': float, 'highpass': int,
+	'lowpass': int, 'audio_format': str, 'audio_mode': str,
+	'stream_copy': bool, 'cache_dir': str, 'video_codec': str,
+}
 #quality = 'fast'
+#required entries and their types for each item type in the yaml file
+item_schema = {
+	'global': { 'speed': dict, },
+	'movie': { 'file': str, 'timing': dict, },
+	'titlecard': { },
+}
+
+whitespace_re = re.compile("  +")
 
 #===============================
 def runCmd(cmd, msg=False):
 	showcmd = cmd.strip()
-	showcmd = re.sub("  *", " ", showcmd)
+	showcmd = whitespace_re.sub(" ", showcmd)
 	if debug is True:
 		print(("CMD: '%s'"%(showcmd)))
+	#no shell, the commands do not use pipes or globs
+	args = shlex.split(showcmd)
 	if msg is True:
-		proc = subprocess.Popen(showcmd, shell=True)
+		subprocess.run(args)
 	else:
-		proc = subprocess.Popen(showcmd, shell=True,
-			stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-	proc.communicate()
+		subprocess.run(args, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
 	return
 
 #===============================
 def common_elements(list1, list2):
+	#dicts are not hashable, so leave them out
+	return list({item for item in list1 if not isinstance(item, dict)}.intersection(list2))
+
+#===============================
+def timeCodeToSeconds(timecode):
+	colons = timecode.split(':')
+	seconds = float(colons.pop())
+	minutes = int(colons.pop())
+	if len(colons) > 0:
+		hours = int(colons.pop())
+	else:
+		hours = 0
+	totalseconds = hours*3600 + minutes*60 + seconds
+	return totalseconds
+
+#===============================
+def avSyncToSeconds(raw_avsync):
+	raw_avsync = raw_avsync.strip()
+	if ':' in raw_avsync:
+		avsync = timeCodeToSeconds(raw_avsync)
+	elif raw_avsync.endswith("ms"):
+		avsync = float(raw_avsync[:-2])/1000.
+	elif raw_avsync.endswith("sec"):
+		avsync = float(raw_avsync[:-3])
+	else:
+		avsync = 0.0
+	return avsync
+
+#===============================
+def linkOrCopy(src, dst):
+	if os.path.exists(dst):
+		os.remove(dst)
 	try:
-		return list(set(list1).intersection(list2))
-	except TypeError:
-		list1a = []
-		for item in list1:
-			if not isinstance(item, dict):
-				list1a.append(item)
-		return list(set(list1a).intersection(list2))
-	sys.exit(1)
+		os.link(src, dst)
+	except OSError:
+		shutil.copy(src, dst)
+	return dst
 
 #===============================
 #===============================
 #===============================
 class EditControl():
-	def __init__(self, yaml_file):
+	def __init__(self, yaml_file, jobs=None):
 		self.debug = debug
 		self.yaml_file = yaml_file
+		self.jobs = jobs
+		self.global_dict = None
 		self.movie_tree = []
 		self.titlecard_tree = []
 		self.readYamlFile()
+		self.validateTree()
 		return
 
 	#===============================
@@ -76,53 +133,214 @@ class EditControl():
 		if file_size > 10**7:
 			print("yaml file is larger that 10MB, that seems too big")
 			sys.exit(1)
-		f = open(self.yaml_file, 'r')
-		#datalist = yaml.load(f)
-		datalist = yaml.safe_load(f)
+		datalist = self.readYamlCache()
 		#print datalist
+		#list that collects the items of each type, global is handled separately
+		type_trees = { 'movie': self.movie_tree, 'titlecard': self.titlecard_tree, }
 		for item in datalist:
 			if not isinstance(item, dict):
 				print(item)
 				print("Hmm, not sure what that was... expecting a dictionary")
 				sys.exit(1)
-			if item.get('type') == 'global':
+			item_type = item.get('type')
+			if item_type == 'global':
 				self.global_dict = item
 				continue
-			elif item.get('type') == 'movie':
-				self.movie_tree.append(item)
-				continue
-			elif item.get('type') == 'titlecard':
-				self.titlecard_tree.append(item)
-				continue
-			else:
+			tree = type_trees.get(item_type)
+			if tree is None:
 				print(item)
 				print("Unknown type")
 				sys.exit(1)
+			tree.append(item)
+
+	#===============================
+	def validateTree(self):
+		#check the whole yaml file before any processing starts,
+		#so a mistake in the last movie is found before the first movie renders
+		if self.global_dict is None:
+			print("yaml file needs a global item")
+			sys.exit(1)
+		for item in [self.global_dict] + self.movie_tree + self.titlecard_tree:
+			for key, keytype in item_schema[item['type']].items():
+				if not isinstance(item.get(key), keytype):
+					print(item)
+					print(("%s item needs a '%s' entry of type %s"
+						%(item['type'], key, keytype.__name__)))
+					sys.exit(1)
+			for category in ('audio', 'video'):
+				settings = item.get(category)
+				if settings is None:
+					continue
+				if not isinstance(settings, dict):
+					print(item)
+					print(("%s settings must be a dict"%(category)))
+					sys.exit(1)
+				for key, value in settings.items():
+					if key not in setting_types:
+						print(item)
+						print(("unknown %s setting '%s'"%(category, key)))
+						sys.exit(1)
+					#convert the same way ProcessMovie.applySettings does
+					try:
+						setting_types[key](value)
+					except (TypeError, ValueError):
+						print(item)
+						print(("%s setting '%s' must be of type %s"
+							%(category, key, setting_types[key].__name__)))
+						sys.exit(1)
+		for key, value in self.global_dict['speed'].items():
+			try:
+				float(value)
+			except (TypeError, ValueError):
+				print(("speed '%s' must be a number: %s"%(key, str(value))))
+				sys.exit(1)
+		for mov_dict in self.movie_tree:
+			self.validateMovie(mov_dict)
+
+	#===============================
+	def validateMovie(self, mov_dict):
+		if not os.path.exists(mov_dict['file']):
+			print(("file not found %s"%(mov_dict['file'])))
+			sys.exit(1)
+		if mov_dict.get('avsync') is not None:
+			try:
+				avSyncToSeconds(mov_dict['avsync'])
+			except (AttributeError, ValueError, IndexError):
+				print(("avsync %s in movie %s is not valid"%(str(mov_dict['avsync']), mov_dict['file'])))
+				sys.exit(1)
+		for timecode, flags in mov_dict['timing'].items():
+			#unquoted timecodes like 01:30 are read by yaml as integers
+			if not isinstance(timecode, str):
+				print(("timecode %s in movie %s must be quoted"%(str(timecode), mov_dict['file'])))
+				sys.exit(1)
+			try:
+				timeCodeToSeconds(timecode)
+			except (ValueError, IndexError):
+				print(("timecode %s in movie %s is not valid"%(timecode, mov_dict['file'])))
+				sys.exit(1)
+			if not isinstance(flags, dict):
+				print(("error: movie flags must be a dict: %s"%(str(flags))))
+				sys.exit(1)
+			titledict = flags.get('titlecard')
+			if titledict:
+				if not isinstance(titledict, dict):
+					print(("error: titlecard must be a dict: %s"%(str(titledict))))
+					sys.exit(1)
+				audio_file = titledict.get('audio_file')
+				if not isinstance(audio_file, str) or not os.path.exists(audio_file):
+					print(("titlecard audio file not found %s"%(str(audio_file))))
+					sys.exit(1)
+		if len(mov_dict['timing']) < 2:
+			print(("movie %s needs at least two timecodes"%(mov_dict['file'])))
+			sys.exit(1)
+
+	#===============================
+	def readYamlCache(self):
+		#parsing yaml is slow, so keep a json copy of the parsed data
+		#next to the yaml file and reuse it while the yaml file is unchanged
+		cache_file = self.yaml_file + ".cache.json"
+		stat = os.stat(self.yaml_file)
+		cache = self.loadYamlCacheFile(cache_file)
+		#unchanged mtime and size, trust the cache without reading the yaml file
+		if (cache is not None and cache.get('mtime_ns') == stat.st_mtime_ns
+				and cache.get('size') == stat.st_size):
+			if self.debug is True:
+				print("using cached yaml data from %s"%(cache_file))
+			return cache['data']
+		f = open(self.yaml_file, 'rb')
+		rawdata = f.read()
+		f.close()
+		sha1 = hashlib.sha1(rawdata).hexdigest()
+		if cache is not None and cache.get('sha1') == sha1:
+			#file was touched but not changed
+			datalist = cache['data']
+		else:
+			datalist = yaml.load(rawdata, Loader=SafeLoader)
+		#only cache data that survives a round trip through json unchanged,
+		#e.g., unquoted timecodes can be parsed as integer keys
+		try:
+			jsondata = json.dumps({'sha1': sha1, 'mtime_ns': stat.st_mtime_ns,
+				'size': stat.st_size, 'data': datalist})
+		except TypeError:
+			return datalist
+		if json.loads(jsondata)['data'] != datalist:
+			return datalist
+		try:
+			f = open(cache_file, 'w')
+			f.write(jsondata)
+			f.close()
+		except (IOError, OSError):
+			print("could not write yaml cache file %s"%(cache_file))
+		return datalist
+
+	#===============================
+	def loadYamlCacheFile(self, cache_file):
+		if not os.path.isfile(cache_file):
+			return None
+		try:
+			f = open(cache_file, 'r')
+			cache = json.load(f)
+			f.close()
+		except (IOError, OSError, ValueError):
+			return None
+		if not isinstance(cache, dict) or 'data' not in cache:
+			return None
+		return cache
 
 	#===============================
 	def concatenateMovies(self, movlist, bigmovie):
+		#the movies in movlist are removed once they are merged
 		if len(movlist) == 0:
 			print("no movies to merge")
 			sys.exit(1)
 		if len(movlist) == 1:
 			print("only one movie, just rename")
-			shutil.copy(movlist[0], bigmovie)
+			shutil.move(movlist[0], bigmovie)
 			return bigmovie
-		cmd = "mkvmerge "
-		for movfile in movlist:
-			duration = medialib.getDuration(movfile)
+		#mediainfo is an external program, so probe all files at once
+		max_workers = min(len(movlist), os.cpu_count() or 1)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+			durations = list(executor.map(medialib.getDuration, movlist))
+		args = []
+		for movfile, duration in zip(movlist, durations):
 			print(("%.1f  %s"%(duration, movfile)))
-			cmd += " %s + "%(movfile)
-		cmd = cmd[:-2]
-		cmd += " -o %s "%(bigmovie)
-		runCmd(cmd)
+			args += [movfile, "+"]
+		args = args[:-1] + ["-o", bigmovie]
+		if len(movlist) > 8:
+			#long file lists go in a json option file instead of the command line
+			optsfile = os.path.splitext(bigmovie)[0] + "-mkvmerge.json"
+			f = open(optsfile, 'w')
+			json.dump(args, f)
+			f.close()
+			runCmd("mkvmerge '@%s'"%(optsfile))
+			os.remove(optsfile)
+		else:
+			runCmd("mkvmerge " + " ".join(shlex.quote(arg) for arg in args))
 		if not os.path.isfile(bigmovie):
 			print("concatenate movies failed")
 			sys.exit(1)
+		for movfile in movlist:
+			os.remove(movfile)
 		return bigmovie
 
+	#===============================
+	def probeMovies(self):
+		#probe each movie file once, all at the same time,
+		#later medialib calls on these files come from its cache
+		movfiles = sorted(set(mov_dict['file'] for mov_dict in self.movie_tree))
+		if len(movfiles) == 0:
+			return
+		max_workers = min(len(movfiles), os.cpu_count() or 1)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+			infolist = list(executor.map(medialib.getMediaInfo, movfiles))
+		for movfile, info in zip(movfiles, infolist):
+			if info is None:
+				print(("could not read media info for %s"%(movfile)))
+				sys.exit(1)
+
 	#===============================
 	def processAllMovies(self):
+		self.probeMovies()
 		processed_movies = []
 
 		for mov_dict in self.movie_tree:
@@ -133,8 +351,6 @@ class EditControl():
 		#merge movies...
 		self.output_file = self.global_dict.get('output_file', 'complete.mkv')
 		self.concatenateMovies(processed_movies, self.output_file)
-		for movfile in processed_movies:
-			os.remove(movfile)
 		print(("mpv %s"%(self.output_file)))
 
 #===============================
@@ -147,23 +363,31 @@ class ProcessMovie():
 		self.editor = editor
 		self.global_dict = editor.global_dict
 		self.mov_dict = mov_dict
+		self.tmpdir = None
 
 		self.movieSettings()
-		self.processMovie()
+		if self.cache_dir is not None and not os.path.isdir(self.cache_dir):
+			os.makedirs(self.cache_dir)
+		try:
+			self.processMovie()
+		finally:
+			if self.tmpdir is not None:
+				shutil.rmtree(self.tmpdir, ignore_errors=True)
 
 	#===============================
 	def movieSettings(self):
-		type_map = { 'quality': str, 'samplerate': int, 'bitrate': int,
-			'crf': int, 'movframerate': int, 'extra_audio_process': bool,
-			'lame_preset': str, 'norm_level': float, 'highpass': int,
-			'lowpass': int, 'audio_format': str, 'audio_mode': str,
-		}
 		self.quality = self.global_dict.get('quality', 'fast')
 		self.norm_level = -9.0
 		self.highpass = 10
 		self.lowpass = 19000
 		self.audio_format = 'WAV'
 		self.audio_mode = 'mono'
+		#stream copy is only used when the source is already hevc at movframerate, see checkMovieFile
+		self.stream_copy = False
+		#directory to keep encoded video sections in for later runs
+		self.cache_dir = None
+		#'auto' picks a hardware hevc encoder when one passes a trial encode
+		self.video_codec = 'libx265'
 		if self.quality == 'fast':
 			self.samplerate = 48000
 			self.bitrate = 16
@@ -180,61 +404,70 @@ class ProcessMovie():
 			self.extra_audio_process = True
 			self.lame_preset = 'standard'
 			self.reverse_compress = True
+		self.normal_speed = float(self.global_dict['speed'].get('normal', 1.1))
+		self.fast_forward_speed = float(self.global_dict['speed'].get('fast_forward', 25))
 		for category in ('audio', 'video'):
-			if self.global_dict.get(category) is not None:
-				for key in list(self.global_dict[category].keys()):
-					if type_map[key] is float:
-						self.__dict__[key] = float(self.global_dict[category].get(key, self.__dict__[key]))
-					elif type_map[key] is int:
-						self.__dict__[key] = int(self.global_dict[category].get(key, self.__dict__[key]))
-					elif type_map[key] is bool:
-						self.__dict__[key] = bool(self.global_dict[category].get(key, self.__dict__[key]))
-					elif type_map[key] is str:
-						self.__dict__[key] = str(self.global_dict[category].get(key, self.__dict__[key]))
-			if self.mov_dict.get(category) is not None:
-				for key in list(self.mov_dict[category].keys()):
-					if type_map[key] is float:
-						self.__dict__[key] = float(self.mov_dict[category].get(key, self.__dict__[key]))
-					elif type_map[key] is int:
-						self.__dict__[key] = int(self.mov_dict[category].get(key, self.__dict__[key]))
-					elif type_map[key] is bool:
-						self.__dict__[key] = bool(self.mov_dict[category].get(key, self.__dict__[key]))
-					elif type_map[key] is str:
-						self.__dict__[key] = str(self.mov_dict[category].get(key, self.__dict__[key]))
+			self.applySettings(self.global_dict, category)
+			self.applySettings(self.mov_dict, category)
+		self.video_codec = ffmpeglib.chooseVideoCodec(self.video_codec)
 
 	#===============================
-	def timeCodeToSeconds(self, timecode):
-		colons = timecode.split(':')
-		seconds = float(colons.pop())
-		minutes = int(colons.pop())
-		if len(colons) > 0:
-			hours = int(colons.pop())
-		else:
-			hours = 0
-		totalseconds = hours*3600 + minutes*60 + seconds
-		return totalseconds
+	def applySettings(self, settings_dict, category):
+		settings = settings_dict.get(category)
+		if settings is None:
+			return
+		for key, value in settings.items():
+			setattr(self, key, setting_types[key](value))
 
 	#===============================
 	def checkMovieFile(self):
-		self.movfile = self.mov_dict.get('file')
-		if self.movfile is None:
-			print("file not specified for processing")
-			sys.exit(1)
-		if not os.path.exists(self.movfile):
-			print(("file not found %s"%(self.movfile)))
-			sys.exit(1)
+		#file was already checked by EditControl.validateTree
+		self.movfile = self.mov_dict['file']
 		medialib.getMediaInfo(self.movfile)
+		#copied sections are appended to hevc encoded sections at movframerate,
+		#so the codec and frame rate must match
+		if self.stream_copy is True:
+			video_format = medialib.getVideoFormat(self.movfile)
+			frame_rate = medialib.getVideoFrameRate(self.movfile)
+			if video_format != 'HEVC':
+				print(("movie %s video is %s not HEVC, re-encoding instead of stream copy"
+					%(self.movfile, video_format)))
+				self.stream_copy = False
+			elif frame_rate is None or abs(frame_rate - self.movframerate) > 0.01:
+				print(("movie %s frame rate is %s not %d, re-encoding instead of stream copy"
+					%(self.movfile, str(frame_rate), self.movframerate)))
+				self.stream_copy = False
+
+	#===============================
+	def makeTempDir(self):
+		#keep the intermediate audio files in RAM when /dev/shm has room for them
+		duration = medialib.getDuration(self.movfile)
+		if self.audio_mode == 'mono':
+			channels = 1
+		else:
+			channels = 2
+		audio_bytes = duration * self.samplerate * self.bitrate/8 * channels
+		basedir = None
+		if os.path.isdir('/dev/shm'):
+			stat = os.statvfs('/dev/shm')
+			#raw, normalized and section audio can all exist at once
+			if stat.f_bavail * stat.f_frsize > 3 * audio_bytes:
+				basedir = '/dev/shm'
+		self.tmpdir = tempfile.mkdtemp(prefix='emwy-', dir=basedir)
+		if self.debug is True:
+			print(("temporary audio directory %s"%(self.tmpdir)))
+
+	#===============================
+	def tmpPath(self, filename):
+		return os.path.join(self.tmpdir, filename)
 
 	#===============================
 	def checkMovieTimings(self):
-		self.timing = self.mov_dict.get('timing')
-		if self.timing is None:
-			print(("timing information not provided for movie %s"%(self.ovfile)))
-			sys.exit(1)
+		self.timing = self.mov_dict['timing']
 		self.time_mapping = {}
 		self.times = []
-		for timecode in list(self.timing.keys()):
-			seconds = self.timeCodeToSeconds(timecode)
+		for timecode in self.timing:
+			seconds = timeCodeToSeconds(timecode)
 			self.time_mapping[seconds] = timecode
 			self.times.append(seconds)
 		self.times.sort()
@@ -244,26 +477,15 @@ class ProcessMovie():
 		raw_avsync = self.mov_dict.get('avsync')
 		if raw_avsync is None:
 			return 0.0
-		raw_avsync = raw_avsync.strip()
-		if ':' in raw_avsync:
-			avsync = self.timeCodeToSeconds(raw_avsync)
-		elif raw_avsync.endswith("ms"):
-			avsync = float(raw_avsync[:-2])/1000.
-		elif raw_avsync.endswith("sec"):
-			avsync = float(raw_avsync[:-3])
-		else:
-			avsync = 0.0
-		return avsync
+		return avSyncToSeconds(raw_avsync)
 
 	#===============================
 	def processNoise(self, orig_wavfile):
 		noisetime1 = None
 		for i in range(len(self.times)):
 			time = self.times[i]
+			#flags were already checked by EditControl.validateTree
 			flags = self.timing[self.time_mapping[time]]
-			if not isinstance(flags, dict):
-				print(("error: movie flags must be a dict: %s"%(str(flags))))
-				sys.exit(1)
 			if 'noise' in flags:
 				noisetime1 = time
 				noisetime2 = self.times[i+1]
@@ -278,60 +500,119 @@ class ProcessMovie():
 	def processAudio(self):
 		### process audio
 		avsync = self.getAVSync()
-		raw_wavfile = ffmpeglib.extractAudio(self.movfile,
+		raw_wavfile = ffmpeglib.extractAudio(self.movfile, self.tmpPath("audio-raw.wav"),
 			samplerate=self.samplerate, bitrate=self.bitrate, audio_mode=self.audio_mode)
-		norm_wavfile = soxlib.normalizeAudio(raw_wavfile, level=self.norm_level,
-			samplerate=self.samplerate, bitrate=self.bitrate)
-		if avsync > 0:
-			shift_wavfile = soxlib.addSilenceToStart(norm_wavfile, seconds=avsync,
-				samplerate=self.samplerate, bitrate=self.bitrate, audio_mode=self.audio_mode)
-			os.remove(norm_wavfile)
-			norm_wavfile = shift_wavfile
-		if norm_wavfile != raw_wavfile:
-			os.remove(raw_wavfile)
-		if self.extra_audio_process is True:
-			#noise_wavfile = self.processNoise(norm_wavfile)
-			#if noise_wavfile != norm_wavfile:
-			#	os.remove(norm_wavfile)
-			#gate_wavfile = soxlib.noiseGate(noise_wavfile)
-			#if gate_wavfile != noise_wavfile:
-			#	os.remove(noise_wavfile)
-			dnr_wavfile = soxlib.compressAudio(norm_wavfile, reverse_compress=self.reverse_compress)
-			if dnr_wavfile != norm_wavfile:
-				os.remove(norm_wavfile)
-			band_wavfile = soxlib.bandPassFilter(dnr_wavfile)
-			if band_wavfile != dnr_wavfile:
-				os.remove(dnr_wavfile)
-			norm_wavfile = "audio-norm-%s.wav"%(self.makeTimestamp())
-			soxlib.normalizeAudio(band_wavfile, norm_wavfile, level=self.norm_level,
-				samplerate=self.samplerate, bitrate=self.bitrate)
-			if norm_wavfile != band_wavfile:
-				os.remove(band_wavfile)
+		#noise reduction and noise gate are disabled, see processNoise
+		norm_wavfile = self.tmpPath("audio-norm-%s.wav"%(self.makeTimestamp()))
+		soxlib.processAudioPipeline(raw_wavfile, norm_wavfile, norm_level=self.norm_level,
+			avsync=avsync, samplerate=self.samplerate, bitrate=self.bitrate,
+			extra_audio_process=self.extra_audio_process, reverse_compress=self.reverse_compress)
+		os.remove(raw_wavfile)
 
 		self.wavfile = norm_wavfile
 		## clean up wave files
 
 	#===============================
-	def splitAudio(self, filename, splitwavfile, startseconds, endseconds):
-		return soxlib.splitAudioSox(filename, splitwavfile, self.movframerate, startseconds, endseconds)
-		return ffmpeglib.splitAudioFfmpeg(filename, splitwavfile, startseconds, endseconds)
+	def splitAndSpeedUpAudio(self, filename, outname, startseconds, endseconds, speed):
+		#outname has no extension, it is added based on the audio format
+		if self.audio_format.upper() == 'MP3':
+			return soxlib.splitAndSpeedUpAudioToMp3(filename, outname+".mp3", self.movframerate,
+				startseconds, endseconds, speed=speed, samplerate=self.samplerate,
+				bitrate=self.bitrate, preset=self.lame_preset)
+		return soxlib.splitAndSpeedUpAudio(filename, outname+".wav", self.movframerate,
+			startseconds, endseconds, speed=speed, samplerate=self.samplerate, bitrate=self.bitrate)
 
 	#=====================
 	def makeTimestamp(self):
-		datestamp = time.strftime("%y%b%d").lower()
-		uppercase = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-		hourstamp = uppercase[(time.localtime()[3])%26]
-		minstamp = "%02d"%(time.localtime()[4])
-		secstamp = uppercase[(time.localtime()[5])%26]
+		localtime = time.localtime()
+		datestamp = time.strftime("%y%b%d", localtime).lower()
+		hourstamp = uppercase[localtime.tm_hour%26]
+		minstamp = "%02d"%(localtime.tm_min)
+		secstamp = uppercase[localtime.tm_sec%26]
 		timestamp = datestamp+hourstamp+minstamp+secstamp
 		return timestamp
 
+	#===============================
+	def processSection(self, starttime, endtime, flags, count, speed):
+		#runs in a worker thread, so all file names must be unique per section
+		out_video_file = "video-section%02d.mkv"%(count)
+		merge_file = "merge-section%02d.mkv"%(count)
+
+		print(("SPEED: %.1f"%(speed)))
+		#cut video
+		self.cutVideoSection(out_video_file, starttime, endtime, flags, speed)
+
+		#cut audio
+		out_audio_file = self.splitAndSpeedUpAudio(self.wavfile, self.tmpPath("audio-section%02d"%(count)),
+			starttime, endtime, speed)
+
+		#merge
+		self.mergeAV(out_video_file, out_audio_file, merge_file)
+		os.remove(out_video_file)
+		os.remove(out_audio_file)
+		return merge_file
+
+	#===============================
+	def cutVideoSection(self, out_video_file, starttime, endtime, flags, speed):
+		#a stale file could be a hard link into the cache, do not write through it
+		if os.path.exists(out_video_file):
+			os.remove(out_video_file)
+		if self.stream_copy is True and abs(speed - 1.0) < 0.01:
+			return self.copyVideo(out_video_file, starttime, endtime)
+		# fast forward sections are only on screen briefly, use a cheap encode
+		if flags.get('type') == 'fastforward':
+			crf = max(self.crf, 30)
+		else:
+			crf = self.crf
+		if self.cache_dir is not None:
+			cache_file = self.sectionCacheFile(starttime, endtime, speed, crf)
+			if os.path.isfile(cache_file):
+				print(("using cached video section %s"%(cache_file)))
+				return linkOrCopy(cache_file, out_video_file)
+		if flags.get('type') == 'fastforward':
+			ffmpeglib.processVideoFastForward(self.movfile, out_video_file, starttime, endtime,
+				speed=speed, crf=crf, movframerate=self.movframerate, video_codec=self.video_codec)
+		else:
+			ffmpeglib.processVideo(self.movfile, out_video_file, starttime, endtime,
+				speed=speed, crf=crf, movframerate=self.movframerate, video_codec=self.video_codec)
+		#a failed or interrupted ffmpeg can still leave a short file, only cache complete sections
+		if self.cache_dir is not None:
+			duration = medialib.getDuration(out_video_file)
+			if abs(duration - (endtime - starttime)/speed) < 0.1:
+				linkOrCopy(out_video_file, cache_file)
+			else:
+				print(("video section %s is %.3f seconds long, not caching it"%(out_video_file, duration)))
+		return out_video_file
+
+	#===============================
+	def sectionCacheFile(self, starttime, endtime, speed, crf):
+		#cached video sections are named after everything that goes into the encode,
+		#so a changed movie file or setting gives a new name
+		stat = os.stat(self.movfile)
+		key = repr((os.path.abspath(self.movfile), stat.st_mtime_ns, stat.st_size,
+			starttime, endtime, speed, crf, self.movframerate, self.video_codec))
+		sha1 = hashlib.sha1(key.encode('utf-8')).hexdigest()
+		return os.path.join(self.cache_dir, "video-section-%s.mkv"%(sha1))
+
+	#===============================
+	def copyVideo(self, out_video_file, starttime, endtime):
+		copy_file = ffmpeglib.copyVideo(self.movfile, out_video_file, starttime, endtime)
+		if copy_file is not None:
+			duration = medialib.getDuration(copy_file)
+			if abs(duration - (endtime - starttime)) < 0.1:
+				return copy_file
+			os.remove(copy_file)
+		print("stream copy failed, re-encoding section")
+		return ffmpeglib.processVideo(self.movfile, out_video_file, starttime, endtime,
+			speed=1.0, crf=self.crf, movframerate=self.movframerate, video_codec=self.video_codec)
+
 	#===============================
 	def processMovie(self):
 		self.checkMovieFile()
+		self.makeTempDir()
 		self.checkMovieTimings()
 		self.processAudio()
-		filesToMerge = []
+		sections = []
 		for i in range(len(self.times)-1):
 			count = i+1
 			starttime = self.times[i]
@@ -341,41 +622,35 @@ class ProcessMovie():
 			if skipcodes.get(flags.get('type')): 
 				print(("skipping section %d..."%(count)))
 				continue
-
-			print("processing...")
-			out_video_file = "video-section%02d.mkv"%(count)
-			out_audio_file = "audio-section%02d.wav"%(count)
-			merge_file = "merge-section%02d.mkv"%(count)
-
 			if flags.get('type') == 'fastforward':
-				speed = float(self.global_dict['speed'].get('fast_forward', 25))
+				speed = self.fast_forward_speed
 			else:
-				speed = float(self.global_dict['speed'].get('normal', 1.1))
-			#cut video
-			print(("SPEED: %.1f"%(speed)))
-			ffmpeglib.processVideo(self.movfile, out_video_file, starttime, endtime,
-				speed=speed, crf=self.crf, movframerate=self.movframerate)
-
-			if flags.get('titlecard'):
-				titlecard_movfile = self.createTitleCard(flags['titlecard'], count)
-				filesToMerge.append(titlecard_movfile)
-
-			#cut audio
-			self.splitAudio(self.wavfile, "audio-split.wav", starttime, endtime)
-			soxlib.speedUpAudio("audio-split.wav", out_audio_file, speed=speed,
-				samplerate=self.samplerate, bitrate=self.bitrate)
-			os.remove("audio-split.wav")
-			if self.global_dict['audio'].get('audio_format').upper() == 'MP3':
-				wavfile = out_audio_file
-				out_audio_file = "audio-section%02d.mp3"%(count)
-				self.wavToMp3(wavfile, out_audio_file, preset=self.lame_preset)
-				os.remove(wavfile)
-
-			#merge
-			self.mergeAV(out_video_file, out_audio_file, merge_file)
-			os.remove(out_video_file)
-			os.remove(out_audio_file)
-			filesToMerge.append(merge_file)
+				speed = self.normal_speed
+			sections.append((starttime, endtime, flags, count, speed))
+
+		jobs = self.editor.jobs
+		if jobs is None:
+			jobs = os.cpu_count() or 1
+		jobs = max(1, min(jobs, len(sections)))
+
+		filesToMerge = []
+		with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+			futures = []
+			try:
+				for starttime, endtime, flags, count, speed in sections:
+					print("processing...")
+					if flags.get('titlecard'):
+						futures.append(executor.submit(self.createTitleCard, flags['titlecard'], count))
+					future = executor.submit(self.processSection, starttime, endtime, flags, count, speed)
+					futures.append(future)
+				for future in futures:
+					filesToMerge.append(future.result())
+			except BaseException:
+				#a failed section or ctrl-c, drop the queued sections instead of
+				#running all of them when the executor shuts down
+				for future in futures:
+					future.cancel()
+				raise
 
 		print("")
 		print(filesToMerge)
@@ -384,12 +659,12 @@ class ProcessMovie():
 		self.finalmovie = "processed-movie-%s.mkv"%(timestamp)
 		self.editor.concatenateMovies(filesToMerge, self.finalmovie)
 		print(("mpv %s"%(self.finalmovie)))
-		for movfile in filesToMerge:
-			os.remove(movfile)
 		os.remove(self.wavfile)
 
 	#===============================
 	def createTitleCard(self, titledict, count):
+		#titlecard pulls in numpy, scipy and PIL, so only import it when needed
+		from emwylib import titlecard
 		tc = titlecard.TitleCard()
 		tc.text = titledict.get('text')
 		(width, height) = medialib.getVideoDimensions(self.movfile)
@@ -398,58 +673,38 @@ class ProcessMovie():
 		tc.framerate = self.movframerate
 		tc.length = 2.0
 		tc.crf = self.crf
+		tc.video_codec = self.video_codec
 		out_video_file = "titlecard-video-section%02d.mkv"%(count)
 		tc.outfile = out_video_file
-		out_audio_file = "titlecard-audio-section%02d.wav"%(count)
+		#runs in a worker thread, so the frame images need unique names
+		tc.imgcode = "titlecard-frame-section%02d-"%(count)
 		merge_file = "titlecard-merge-section%02d.mkv"%(count)
 		if titledict.get('font_size'):
 			tc.size = int(titledict.get('font_size'))
 		tc.setType()
 		tc.createCards()
 
-		convwavfile = "audio-tc-convert.wav"
-		soxlib.convertAudioToWav(titledict.get('audio_file'),  convwavfile, audio_mode=self.audio_mode)
-
+		#convert and normalize in one sox run
 		norm_level = titledict.get('norm_level', self.norm_level)
-		normwavfile = "audio-tc-norm.wav"
-		soxlib.normalizeAudio(convwavfile, normwavfile, level=norm_level,
-			samplerate=self.samplerate, bitrate=self.bitrate)
-		os.remove(convwavfile)
+		normwavfile = self.tmpPath("audio-tc-norm%02d.wav"%(count))
+		soxlib.normalizeAudio(titledict.get('audio_file'), normwavfile, level=norm_level,
+			samplerate=self.samplerate, bitrate=self.bitrate, audio_mode=self.audio_mode)
 
 		endtime = medialib.getDuration(out_video_file)
-		speed = float(self.global_dict['speed'].get('normal', 1.1))
-		self.splitAudio(normwavfile, "audio-split.wav", 0, endtime*speed)
+		speed = self.normal_speed
+		out_audio_file = self.splitAndSpeedUpAudio(normwavfile, self.tmpPath("titlecard-audio-section%02d"%(count)),
+			0, endtime*speed, speed)
 		os.remove(normwavfile)
 
-		soxlib.speedUpAudio("audio-split.wav", out_audio_file, speed=speed,
-			samplerate=self.samplerate, bitrate=self.bitrate)
-		os.remove("audio-split.wav")
-
-		if self.global_dict['audio'].get('audio_format').upper() == 'MP3':
-			wavfile = out_audio_file
-			out_audio_file = "titlecard-audio-section%02d.mp3"%(count)
-			self.wavToMp3(wavfile, out_audio_file, preset=self.lame_preset)
-			os.remove(wavfile)
-
 		self.mergeAV(out_video_file, out_audio_file, merge_file)
 		os.remove(out_video_file)
 		os.remove(out_audio_file)
 		return merge_file
 
-	#===============================
-	def wavToMp3(self, wavfile, mp3file, preset='medium'):
-		presetlist = ['voice', 'radio', 'medium', 'standard', 'extreme']
-		cmd = "lame "
-		cmd += " --nohist -q 0 -p "
-		cmd += " --preset %s "%(preset)
-		cmd += "'%s' "%(wavfile)
-		cmd += "'%s' "%(mp3file)
-		runCmd(cmd)
-
 	#===============================
 	def mergeAV(self, video_file, audio_file, merge_file):
-		vtime = medialib.getDuration(video_file)
-		atime = medialib.getDuration(audio_file)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+			(vtime, atime) = executor.map(medialib.getDuration, (video_file, audio_file))
 		print(("Audio: %.3f // Video %.3f"%(atime, vtime)))
 		if abs(atime - vtime) > 0.1:
 			print(("time error: %.3f %.3f"%(atime,vtime)))
@@ -472,9 +727,11 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='CLI Movie Editor')
 	parser.add_argument('-y', '--yaml', dest='yamlfile',
 		help='main yaml file that outlines the processing to do')
+	parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+		help='number of movie sections to process at the same time, default is cpu count')
 	args = parser.parse_args()
 
-	editor = EditControl(args.yamlfile)
+	editor = EditControl(args.yamlfile, jobs=args.jobs)
 	pprint.pprint(editor.global_dict)
 	pprint.pprint(editor.movie_tree)
 	editor.processAllMovies()
@@ -3,28 +3,108 @@
 import re
 import os
 import sys
+import shlex
 import time
+import threading
 import subprocess
 
+whitespace_re = re.compile("  +")
+
 #===============================
 def runCmd(cmd, msg=False):
 	showcmd = cmd.strip()
-	showcmd = re.sub("  *", " ", showcmd)
+	showcmd = whitespace_re.sub(" ", showcmd)
 	print(("CMD: '%s'"%(showcmd)))
+	#no shell, the commands do not use pipes or globs
+	args = shlex.split(showcmd)
 	if msg is True:
-		proc = subprocess.Popen(showcmd, shell=True)
+		subprocess.run(args)
 	else:
-		proc = subprocess.Popen(showcmd, shell=True,
-			stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-	proc.communicate()
+		subprocess.run(args, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
 	return
 
+#===============================
+def runEncodeCmd(cmd, video_codec='libx265'):
+	# consumer nvidia cards only allow a few nvenc sessions at once,
+	# so hardware encodes from the worker threads take turns
+	if video_codec == 'libx265':
+		runCmd(cmd)
+		return
+	with hardware_sessions:
+		runCmd(cmd)
+	return
+
+#hevc encoders in order of preference for video_codec 'auto', libx265 is the software fallback
+#hevc_vaapi is left out since it needs a device and a hwupload filter
+auto_video_codecs = ('hevc_nvenc', 'hevc_qsv', 'hevc_videotoolbox', 'libx265')
+available_encoders = None
+#trial encode result for each hardware encoder, ffmpeg lists encoders
+#it was built with even when the hardware is missing
+working_encoders = {}
+hardware_session_limit = 2
+hardware_sessions = threading.BoundedSemaphore(hardware_session_limit)
+
+#===============================
+def getAvailableEncoders():
+	# ask ffmpeg once for its list of encoders
+	global available_encoders
+	if available_encoders is None:
+		proc = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"],
+			stderr=subprocess.DEVNULL, stdout=subprocess.PIPE)
+		available_encoders = set()
+		for line in proc.stdout.decode('utf-8', 'replace').splitlines():
+			bits = line.split()
+			# encoder lines look like ' V....D libx265   libx265 H.265 / HEVC'
+			if len(bits) >= 2 and len(bits[0]) == 6 and bits[0][0] == 'V':
+				available_encoders.add(bits[1])
+	return available_encoders
+
+#===============================
+def chooseVideoCodec(video_codec='libx265'):
+	if video_codec != 'auto':
+		return video_codec
+	encoders = getAvailableEncoders()
+	for codec in auto_video_codecs:
+		if codec == 'libx265':
+			break
+		if codec in encoders and testVideoCodec(codec) is True:
+			return codec
+	return 'libx265'
+
+#===============================
+def testVideoCodec(video_codec):
+	# encode a short blank clip to check the encoder has working hardware
+	if video_codec not in working_encoders:
+		cmd = "ffmpeg -nostats -loglevel error -f lavfi -i color=s=256x256:d=0.1 "
+		cmd += videoCodecOptions(video_codec)
+		cmd += " -f null - "
+		proc = subprocess.run(shlex.split(cmd), stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+		working_encoders[video_codec] = (proc.returncode == 0)
+		if working_encoders[video_codec] is False:
+			print(("video encoder %s is not usable, skipping it"%(video_codec)))
+	return working_encoders[video_codec]
+
+#===============================
+def videoCodecOptions(video_codec='libx265', crf=25, preset='ultrafast'):
+	# hardware encoders do not have crf, use their constant quality mode instead
+	if video_codec == 'hevc_nvenc':
+		return " -codec:v hevc_nvenc -rc constqp -qp %d -preset p1 -pix_fmt yuv420p "%(crf)
+	if video_codec == 'hevc_qsv':
+		return " -codec:v hevc_qsv -global_quality %d -preset veryfast -pix_fmt nv12 "%(crf)
+	if video_codec == 'hevc_videotoolbox':
+		# quality scale is 1-100, higher is better
+		quality = max(1, min(100, 100 - 2*crf))
+		return " -codec:v hevc_videotoolbox -q:v %d -pix_fmt yuv420p "%(quality)
+	cmd  = " -codec:v libx265 -crf %d -preset %s "%(crf, preset)
+	cmd += " -tune fastdecode -profile:v main444-12 -pix_fmt yuv420p "
+	return cmd
+
 #===============================
 def splitAudioFfmpeg(movfile, wavfile, startseconds, endseconds, samplerate=96, bitrate=24):
 	# not used, created for testing purposes only
 	sys.exit(1)
 	cutseconds = endseconds - startseconds
-	cmd  = "ffmpeg -y "
+	cmd  = "ffmpeg -y -nostats -loglevel error "
 	cmd += " -ss %.2f -t %.2f "%(startseconds, cutseconds)
 	cmd += " -i %s "%(movfile)
 	cmd += " -sn -vn "
@@ -37,31 +117,64 @@ def splitAudioFfmpeg(movfile, wavfile, startseconds, endseconds, samplerate=96,
 	return wavfile
 
 #===============================
-def processVideo(movfile, outfile, starttime, endtime, speed=1.1, crf=25, movframerate=60, preset='ultrafast'):
-	t0 = time.time()
-	cmd  = "ffmpeg -y "
+def processVideo(movfile, outfile, starttime, endtime, speed=1.1, crf=25, movframerate=60, preset='ultrafast',
+		video_codec='libx265'):
+	t0 = time.monotonic()
+	cmd  = "ffmpeg -y -nostats -loglevel error "
 	cmd += " -ss %.2f -t %.2f "%(starttime, endtime-starttime)
 	cmd += " -i %s "%(movfile)
 	cmd += " -sn -an -map_chapters -1 -map_metadata -1 "
 	#cmd += " -i ~/sh/vosslab_logo-vector50.png "
 	#cmd += " -filter_complex 'overlay=main_w-overlay_w-10:main_h-overlay_h-10'"
-	cmd += " -codec:v libx265 -crf %d -preset %s "%(crf, preset)
-	cmd += " -tune fastdecode -profile:v main444-12 -pix_fmt yuv420p "
+	cmd += videoCodecOptions(video_codec, crf, preset)
 	cmd += " -r %d "%(movframerate)
 	if abs(speed - 1.0) > 0.01:
 		cmd += " -filter:v 'setpts=%.8f*PTS' "%(1.0/speed)
 	cmd += " %s "%(outfile)
-	runCmd(cmd)
+	runEncodeCmd(cmd, video_codec)
+	if not os.path.isfile(outfile):
+		print(("fast forward %.1fX failed"%(speed)))
+		sys.exit(1)
+	print(("Complete in %d seconds"%(time.monotonic() - t0)))
+	return outfile
+
+#===============================
+def processVideoFastForward(movfile, outfile, starttime, endtime, speed=25, crf=30, movframerate=60, preset='ultrafast',
+		video_codec='libx265'):
+	# fast forward sections are only on screen briefly, use a cheap encode
+	t0 = time.monotonic()
+	cmd  = "ffmpeg -y -nostats -loglevel error "
+	cmd += " -ss %.2f -t %.2f "%(starttime, endtime-starttime)
+	cmd += " -i %s "%(movfile)
+	cmd += " -sn -an -map_chapters -1 -map_metadata -1 "
+	cmd += " -filter:v 'setpts=%.8f*PTS,fps=%d' "%(1.0/speed, movframerate)
+	cmd += videoCodecOptions(video_codec, crf, preset)
+	cmd += " %s "%(outfile)
+	runEncodeCmd(cmd, video_codec)
 	if not os.path.isfile(outfile):
 		print(("fast forward %.1fX failed"%(speed)))
 		sys.exit(1)
-	print(("Complete in %d seconds"%(time.time() - t0)))
+	print(("Complete in %d seconds"%(time.monotonic() - t0)))
+	return outfile
+
+#===============================
+def copyVideo(movfile, outfile, starttime, endtime):
+	# stream copy cuts on keyframes, so the caller must check the duration
+	cmd  = "ffmpeg -y -nostats -loglevel error "
+	cmd += " -ss %.2f -t %.2f "%(starttime, endtime-starttime)
+	cmd += " -i %s "%(movfile)
+	cmd += " -sn -an -map_chapters -1 -map_metadata -1 "
+	cmd += " -codec:v copy "
+	cmd += " %s "%(outfile)
+	runCmd(cmd)
+	if not os.path.isfile(outfile):
+		return None
 	return outfile
 
 #===============================
 def addWatermark(movfile, outfile, watermark_file=None, crf=25, movframerate=60, preset='ultrafast'):
-	t0 = time.time()
-	cmd  = "ffmpeg -y "
+	t0 = time.monotonic()
+	cmd  = "ffmpeg -y -nostats -loglevel error "
 	cmd += " -i '%s' "%(movfile)
 	cmd += " -sn -an "
 	cmd += " -i '%s' "%(watermark_file)
@@ -74,12 +187,12 @@ def addWatermark(movfile, outfile, watermark_file=None, crf=25, movframerate=60,
 	if not os.path.isfile(outfile):
 		print("add watermark failed")
 		sys.exit(1)
-	print(("Complete in %d seconds"%(time.time() - t0)))
+	print(("Complete in %d seconds"%(time.monotonic() - t0)))
 	return outfile
 
 #===============================
 def replaceAudio(movfile, wavfile, newmovfile):
-	cmd  = "ffmpeg -y "
+	cmd  = "ffmpeg -y -nostats -loglevel error "
 	cmd += " -i '%s' "%(movfile)
 	cmd += " -i '%s' "%(wavfile)
 	cmd += " -sn "
@@ -94,7 +207,7 @@ def replaceAudio(movfile, wavfile, newmovfile):
 
 #===============================
 def extractAudio(movfile, wavfile='audio-raw.wav', samplerate=96, bitrate=24, audio_mode=None):
-	cmd  = "ffmpeg -y "
+	cmd  = "ffmpeg -y -nostats -loglevel error "
 	cmd += " -i '%s' "%(movfile)
 	cmd += " -sn -vn "
 	cmd += " -acodec pcm_s%dle -ar %d -rf64 auto "%(bitrate, samplerate)
@@ -1,15 +1,28 @@
 
 #python wrapper for mediainfo
 
+import os
 import json
 import subprocess
 
+# mediainfo results keyed by (path, mtime, size), so rewritten files are probed again
+_mediainfo_cache = {}
+
 #===============================
 def getMediaInfo(mediafile):
-	cmd = "mediainfo --Output=JSON %s"%(mediafile)
-	proc = subprocess.Popen(cmd, shell=True,
-		stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-	stdout, stderr = proc.communicate()
+	stat = os.stat(mediafile)
+	key = (os.path.abspath(mediafile), stat.st_mtime_ns, stat.st_size)
+	data = _mediainfo_cache.get(key)
+	if data is None:
+		data = _runMediaInfo(mediafile)
+		_mediainfo_cache[key] = data
+	return data
+
+#===============================
+def _runMediaInfo(mediafile):
+	cmd = ["mediainfo", "--Output=JSON", mediafile]
+	proc = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+	stdout = proc.stdout
 	rawdata = json.loads(stdout)
 	data = rawdata.get('media')
 	return data
@@ -33,3 +46,19 @@ def getVideoDimensions(mediafile):
 	width = int(videotrack['Width'])
 	height = int(videotrack['Height'])
 	return (width, height)
+
+#===============================
+def getVideoFormat(mediafile):
+	data = getMediaInfo(mediafile)
+	for track in data.get('track'):
+		if track.get('@type') == 'Video':
+			return track.get('Format')
+	return None
+
+#===============================
+def getVideoFrameRate(mediafile):
+	data = getMediaInfo(mediafile)
+	for track in data.get('track'):
+		if track.get('@type') == 'Video' and track.get('FrameRate') is not None:
+			return float(track['FrameRate'])
+	return None
@@ -3,29 +3,80 @@
 import re
 import os
 import sys
+import shlex
 import time
 import subprocess
 
+whitespace_re = re.compile("  +")
+
 #===============================
 def runCmd(cmd, msg=False):
 	showcmd = cmd.strip()
-	showcmd = re.sub("  *", " ", showcmd)
+	showcmd = whitespace_re.sub(" ", showcmd)
 	print(("CMD: '%s'"%(showcmd)))
+	#no shell, the commands do not use pipes or globs
+	args = shlex.split(showcmd)
 	if msg is True:
-		proc = subprocess.Popen(showcmd, shell=True)
+		subprocess.run(args)
 	else:
-		proc = subprocess.Popen(showcmd, shell=True,
-			stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-	proc.communicate()
+		subprocess.run(args, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
 	return
 
 #===============================
-def normalizeAudio(wavfile, normwavfile="audio-norm.wav", level=-1.9, samplerate=None, bitrate=None):
+def processAudioPipeline(wavfile, outwavfile="audio-norm.wav", norm_level=-1.9, avsync=0.0,
+		samplerate=None, bitrate=None, extra_audio_process=False, reverse_compress=True,
+		highpass=20, lowpass=10000):
+	# one sox run with all the effects chained,
+	# same as normalizeAudio, addSilenceToStart, compressAudio, bandPassFilter, normalizeAudio
 	cmd = "sox %s "%(wavfile,)
 	if samplerate is not None:
 		cmd += "-r %d "%(samplerate,)
 	if bitrate is not None:
 		cmd += "-b %d "%(bitrate,)
+	cmd += "%s norm %.1f "%(outwavfile, norm_level)
+	if avsync > 0:
+		cmd += " pad %.4f "%(avsync)
+	if extra_audio_process is True:
+		cmd += " compand 0.2,1 6:-70,-60,-20 -13 -50 0.2 "
+		if reverse_compress is True:
+			#double DRC in reverse direction
+			cmd += " reverse compand 0.2,1 6:-70,-60,-20 -13 -50 0.2 reverse "
+		cmd += " lowpass %d highpass %d "%(lowpass, highpass)
+		cmd += " norm %.1f "%(norm_level)
+	runCmd(cmd)
+	if not os.path.isfile(outwavfile):
+		print("audio processing failed")
+		sys.exit(1)
+	return outwavfile
+
+#===============================
+def runPipe(cmd1, cmd2):
+	# run cmd1 | cmd2 without a shell
+	showcmd1 = whitespace_re.sub(" ", cmd1.strip())
+	showcmd2 = whitespace_re.sub(" ", cmd2.strip())
+	print(("CMD: '%s | %s'"%(showcmd1, showcmd2)))
+	proc1 = subprocess.Popen(shlex.split(showcmd1),
+		stderr=subprocess.DEVNULL, stdout=subprocess.PIPE)
+	proc2 = subprocess.Popen(shlex.split(showcmd2), stdin=proc1.stdout,
+		stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+	# let cmd1 get SIGPIPE if cmd2 exits early
+	proc1.stdout.close()
+	proc2.wait()
+	proc1.wait()
+	return
+
+#===============================
+def normalizeAudio(wavfile, normwavfile="audio-norm.wav", level=-1.9, samplerate=None, bitrate=None, audio_mode=None):
+	# wavfile can be any format sox reads, audio_mode also converts the channels
+	cmd = "sox %s "%(wavfile,)
+	if samplerate is not None:
+		cmd += "-r %d "%(samplerate,)
+	if bitrate is not None:
+		cmd += "-b %d "%(bitrate,)
+	if audio_mode == "mono":
+		cmd += "-c 1 "
+	elif audio_mode == "stereo":
+		cmd += "-c 2 "
 	cmd += "%s norm %.1f"%(normwavfile, level)
 	runCmd(cmd)
 	if not os.path.isfile(normwavfile):
@@ -89,7 +140,7 @@ def convertAudioToWav(infile, wavfile, audio_mode=None):
 	return wavfile
 
 #===============================
-def splitAudioSox(wavfile, splitwavfile, movframerate, startseconds, endseconds):
+def _syncTrim(movframerate, startseconds, endseconds):
 	cutseconds = endseconds - startseconds
 	### correction for audio sync between ffmpeg and sox
 	### one over the frame rate??
@@ -99,8 +150,13 @@ def splitAudioSox(wavfile, splitwavfile, movframerate, startseconds, endseconds)
 	if start < 0:
 		start = 0
 		end += gap
+	return (start, cutseconds + gap)
+
+#===============================
+def splitAudioSox(wavfile, splitwavfile, movframerate, startseconds, endseconds):
+	start, length = _syncTrim(movframerate, startseconds, endseconds)
 	cmd = ("sox %s %s trim %.3f %.3f"
-		%(wavfile, splitwavfile, start, cutseconds + gap))
+		%(wavfile, splitwavfile, start, length))
 	runCmd(cmd)
 	if not os.path.isfile(splitwavfile):
 		print("speed up audio failed")
@@ -109,7 +165,7 @@ def splitAudioSox(wavfile, splitwavfile, movframerate, startseconds, endseconds)
 
 #===============================
 def speedUpAudio(wavfile, fastwavfile="audio-fast.wav", speed=1.1, samplerate=None, bitrate=None):
-	t0 = time.time()
+	t0 = time.monotonic()
 	cmd = "sox %s "%(wavfile,)
 	if samplerate is not None:
 		cmd += "-r %d "%(samplerate,)
@@ -120,9 +176,51 @@ def speedUpAudio(wavfile, fastwavfile="audio-fast.wav", speed=1.1, samplerate=No
 	if not os.path.isfile(fastwavfile):
 		print("speed up audio failed")
 		sys.exit(1)
-	print(("Complete in %d seconds"%(time.time() - t0)))
+	print(("Complete in %d seconds"%(time.monotonic() - t0)))
 	return fastwavfile
 
+#===============================
+def splitAndSpeedUpAudio(wavfile, fastwavfile, movframerate, startseconds, endseconds,
+		speed=1.1, samplerate=None, bitrate=None):
+	# same as splitAudioSox then speedUpAudio, without the split wav in between
+	t0 = time.monotonic()
+	start, length = _syncTrim(movframerate, startseconds, endseconds)
+	cmd = "sox %s "%(wavfile,)
+	if samplerate is not None:
+		cmd += "-r %d "%(samplerate,)
+	if bitrate is not None:
+		cmd += "-b %d "%(bitrate,)
+	cmd += "%s trim %.3f %.3f tempo -s %.8f"%(fastwavfile, start, length, speed)
+	runCmd(cmd)
+	if not os.path.isfile(fastwavfile):
+		print("split and speed up audio failed")
+		sys.exit(1)
+	print(("Complete in %d seconds"%(time.monotonic() - t0)))
+	return fastwavfile
+
+#===============================
+def splitAndSpeedUpAudioToMp3(wavfile, mp3file, movframerate, startseconds, endseconds,
+		speed=1.1, samplerate=None, bitrate=None, preset='medium'):
+	# same as splitAndSpeedUpAudio, but sox pipes the wav straight into lame
+	t0 = time.monotonic()
+	start, length = _syncTrim(movframerate, startseconds, endseconds)
+	soxcmd = "sox %s "%(wavfile,)
+	if samplerate is not None:
+		soxcmd += "-r %d "%(samplerate,)
+	if bitrate is not None:
+		soxcmd += "-b %d "%(bitrate,)
+	soxcmd += "-t wav - trim %.3f %.3f tempo -s %.8f"%(start, length, speed)
+	lamecmd = "lame "
+	lamecmd += " --nohist -q 0 -p "
+	lamecmd += " --preset %s "%(preset)
+	lamecmd += " - '%s' "%(mp3file)
+	runPipe(soxcmd, lamecmd)
+	if not os.path.isfile(mp3file):
+		print("split and speed up audio to mp3 failed")
+		sys.exit(1)
+	print(("Complete in %d seconds"%(time.monotonic() - t0)))
+	return mp3file
+
 #===============================
 def compressAudio(wavfile, drcwavfile="audio-drc.wav", reverse_compress=True):
 	cmd = "sox %s %s compand 0.2,1 6:-70,-60,-20 -13 -50 0.2 "%(wavfile, drcwavfile)
@@ -5,7 +5,9 @@
 ###
 
 import re
+import os
 import sys
+import shlex
 import copy
 import numpy
 import random
@@ -16,19 +18,22 @@ from scipy import misc
 from PIL import ImageDraw
 from PIL import ImageFont
 from scipy.ndimage import filters
+from emwylib import ffmpeglib
 from emwylib.transforms import RGBTransform
 
+whitespace_re = re.compile("  +")
+
 #===============================
 def runCmd(cmd, msg=False):
 	showcmd = cmd.strip()
-	showcmd = re.sub("  *", " ", showcmd)
+	showcmd = whitespace_re.sub(" ", showcmd)
 	print(("CMD: '%s'"%(showcmd)))
+	#no shell, the commands do not use pipes or globs
+	args = shlex.split(showcmd)
 	if msg is True:
-		proc = subprocess.Popen(showcmd, shell=True)
+		subprocess.run(args)
 	else:
-		proc = subprocess.Popen(showcmd, shell=True,
-			stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-	proc.communicate()
+		subprocess.run(args, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
 	return
 
 #===============================
@@ -41,6 +46,7 @@ class TitleCard(object):
 		self.width = 1600
 		self.height = 900
 		self.crf = 28
+		self.video_codec = 'libx265'
 		self.fontfile = "/Users/vosslab/Library/Fonts/OpenDyslexic-Regular.ttf"
 		self.bgcolor = (51, 153, 255)
 		self.textcolor = (142, 71, 0)
@@ -77,13 +83,17 @@ class TitleCard(object):
 
 	#===============================
 	def makeMovieFromImages(self, imglist):
-		cmd = "ffmpeg -y "
+		cmd = "ffmpeg -y -nostats -loglevel error "
 		cmd += " -r %d "%(self.framerate)
 		cmd += " -i %s%s.png "%(self.imgcode, "%05d")
-		cmd += " -codec:v libx265 -filter:v 'fps=%d,format=yuv420p' "%(self.framerate)
-		cmd += " -crf %d -preset ultrafast -tune fastdecode -profile:v high -pix_fmt yuv420p "%(self.crf)
+		if self.video_codec == 'libx265':
+			cmd += " -codec:v libx265 -filter:v 'fps=%d,format=yuv420p' "%(self.framerate)
+			cmd += " -crf %d -preset ultrafast -tune fastdecode -profile:v high -pix_fmt yuv420p "%(self.crf)
+		else:
+			cmd += " -filter:v 'fps=%d,format=yuv420p' "%(self.framerate)
+			cmd += ffmpeglib.videoCodecOptions(self.video_codec, self.crf)
 		cmd += " %s "%(self.outfile)
-		runCmd(cmd)
+		ffmpeglib.runEncodeCmd(cmd, self.video_codec)
 
 	#===============================
 	def cloudBase(self, bgcolor):
@@ -157,8 +167,8 @@ class TitleCard(object):
 			imglist.append(imgname)
 		sys.stderr.write("\n")
 		self.makeMovieFromImages(imglist)
-		cmd = "rm %s%s.png "%(self.imgcode, "*")
-		runCmd(cmd)
+		for imgname in imglist:
+			os.remove(imgname)
 		print("done")
 
 #===============================